@@ -6,13 +6,14 @@ using the PsychoPy library. The main components can be broadly categorized into:
 
 1. **Initialization & Configuration**:
     - Setting up paths for stimuli, recordings, results, pictograms, and randomization.
-    - Functionality to initialize the experiment window (`create_window`) suitable for laboratory and personal environments.
+    - Functionality to initialize the experiment window (`create_window`) suitable for laboratory and personal environments,
+      and to close it at the end of the experiment (`close_window`).
     - Initialization of visual stimuli like pictograms, prompts, and fixation crosses (`initialize_stimuli`).
     - Participant information retrieval with a date-time stamped unique identifier (`get_participant_info`).
 
 2. **Experiment Execution**:
-    - Function to append experimental results to a CSV file in a consistent manner (`append_result_to_csv`).
-    - A utility to display messages on the experiment window, with options for a timed display or waiting for a user response (`show_message`).
+    - A buffered writer to append experimental results to a CSV file in a consistent manner (`ResultWriter`).
+    - Text stimuli for displaying messages on the experiment window (`get_text_stim`).
 
 The module is designed to be versatile, allowing for easy setup on different machines (like laboratory setups or personal laptops)
 and ensuring consistent data capture across different sessions and participants.
@@ -20,8 +21,13 @@ and ensuring consistent data capture across different sessions and participants.
 
 
 # Import necessary libraries
-from psychopy import event, monitors, visual, gui, core
+# PsychoPy and Pillow are imported inside the functions that need them, so importing this module
+# for its path constants (e.g. from analysis scripts) doesn't pull in the heavy graphics stack
+from collections import namedtuple
+import csv
 import datetime
+import json
+import operator
 import os
 import sys
 
@@ -49,86 +55,210 @@ practice_stim_path = resource_path('stimuli/practice_stimuli/')
 output_path = resource_path('results/')
 # directory for the pictograms used
 pics_path = resource_path('pics/')
+# pictograms shown while the stimulus plays and while recording
+AUDIO_PNG = os.path.join(pics_path, 'audio.png')
+REC_PNG = os.path.join(pics_path, 'rec.png')
 # directory for all recordings
 record_path = resource_path('recordings/')
 # directory for randomized stimuli
 random_path = resource_path('randomization/')
+# subject ID of the last session, used to pre-fill the participant dialog
+last_participant_file = resource_path('.last_participant.json')
+
+# default parameters for the recordings
+FS = 48000  # Sample rate
+VISUAL_FRAMES = 350  # Recording duration in frames of the monitor
+# Recording duration in seconds, if set via the IMIT_REC_SECONDS environment variable (e.g. for headless runs).
+# Otherwise it is calculated from VISUAL_FRAMES and the measured frame rate.
+REC_SECONDS = float(os.environ['IMIT_REC_SECONDS']) if os.environ.get('IMIT_REC_SECONDS') else None
+
+# Measured frame rates per window, so the slow frame-timing probe runs only once per window
+_frame_rate_cache = {}
+# Decoded pictograms per file path, so the PNG files are read and decoded only once
+_image_cache = {}
+# Initialized stimuli per (window, recording duration), so later phases reuse them
+_stimuli_cache = {}
+# The experiment window, once created, and whether it was opened for the lab
+_window = None
+_window_lab = None
+
+
+def create_window(lab=False):
+    """
+    Create and initialize the experiment window.
+
+    The window is created once and the same window is returned on later calls, so it can be shared
+    across the practice and test phases. Do not call `win.close()` mid-experiment; use `close_window`
+    at the end of the experiment instead.
 
-# to use in acoustic lab - second monitor name fixed here
-# def create_window():
-#    """
-#    Create and initialize the experiment window.
-#
-#    Returns:
-#    win: A PsychoPy visual.Window object for the experiment.
-#    """
-#    # Create a monitor object for the second screen
-#    second_monitor = monitors.Monitor(name='EA273WMi')
-#    # Set the appropriate settings for the second monitor
-#    second_monitor.setSizePix((1920, 1080))  # Set the desired resolution of the second screen
-#
-#    # Create and return a window for the experiment on the second monitor
-#    return visual.Window(monitor=second_monitor,  # Use the second monitor
-#                         size=(1920, 1080),
-#                         screen=1,  # Specify the index of the second screen (0 for the first screen, 1 for the second, etc.)
-#                         allowGUI=True,
-#                         fullscr=True,
-#                         color=(255, 255, 255)
-#                         )
-
-
-# to use for testing on laptop
-def create_window():
-    """
-    Create and initialize the experiment window suitable for testing on a laptop.
+    Parameters:
+    lab: If True, open the window on the second monitor of the acoustic lab ('EA273WMi', 1920x1080).
+         If False (default), open it on the standard display for testing on a laptop.
 
     Returns:
-    win: A PsychoPy visual.Window object for the experiment tailored for standard laptop displays.
+    win: A PsychoPy visual.Window object for the experiment.
+
+    Raises:
+    ValueError: If a window is already open with a different `lab` setting.
+    """
+    global _window, _window_lab
+    if _window is not None:
+        # Never open a second fullscreen window; the open one must be closed first
+        if bool(lab) != _window_lab:
+            raise ValueError(f"The experiment window is already open with lab={_window_lab}; "
+                             "call close_window before creating one with a different setting")
+        return _window
+
+    from psychopy import monitors, visual
+    if lab:
+        # Create a monitor object for the second screen - second monitor name fixed here
+        second_monitor = monitors.Monitor(name='EA273WMi')
+        # Set the appropriate settings for the second monitor
+        second_monitor.setSizePix((1920, 1080))  # Set the desired resolution of the second screen
+
+        # Create a window for the experiment on the second monitor
+        win = visual.Window(monitor=second_monitor,  # Use the second monitor
+                            size=(1920, 1080),
+                            screen=1,  # Specify the index of the second screen (0 for the first screen, 1 for the second, etc.)
+                            allowGUI=True,
+                            fullscr=True,
+                            color=(255, 255, 255)
+                            )
+    else:
+        # Create a monitor object
+        current_monitor = monitors.Monitor(name='testMonitor')
+
+        # Create a window for the experiment
+        win = visual.Window(monitors.Monitor.getSizePix(current_monitor),
+                            monitor="testMonitor",
+                            allowGUI=True,
+                            fullscr=True,
+                            color=(255, 255, 255)
+                            )
+
+    # Measure the refresh rate once, right away, unless the recording duration is fixed
+    if REC_SECONDS is None:
+        _get_frame_rate(win)
+
+    _window, _window_lab = win, bool(lab)
+    return win
+
+
+def close_window(window):
+    """
+    Close the experiment window at the end of the experiment and drop everything cached for it.
+
+    Parameters:
+    window: The PsychoPy visual.Window object returned by `create_window`.
+    """
+    global _window, _window_lab
+    window.close()
+    if window is _window:
+        _window, _window_lab = None, None
+    # Window ids can be reused after the window is gone, so forget the per-window caches
+    _frame_rate_cache.pop(id(window), None)
+    for key in [key for key in _stimuli_cache if key[0] == id(window)]:
+        del _stimuli_cache[key]
+
+
+def _get_frame_rate(window, n_identical=10, n_max_frames=100):
+    """
+    Return the refresh rate of the given window, measuring it only on the first call per window.
+
+    Parameters:
+    window: A PsychoPy visual.Window object.
+    n_identical: Number of consecutive similar frame intervals required for a valid measurement.
+    n_max_frames: Maximum number of frames to sample before giving up (lower values are faster but less accurate).
+
+    Returns:
+    float: The estimated frame rate in Hz (60 if the measurement fails).
+    """
+    key = id(window)
+    if key not in _frame_rate_cache:
+        # If for some reason the measurement fails, it returns None.
+        # In this case, default to a reasonable estimate of 60 Hz.
+        _frame_rate_cache[key] = window.getActualFrameRate(nIdentical=n_identical,
+                                                           nMaxFrames=n_max_frames) or 60
+    return _frame_rate_cache[key]
+
+
+class Fixation(namedtuple('Fixation', ['vertical', 'horizontal'])):
+    """Fixation cross made of a vertical and a horizontal line, drawn together."""
+
+    __slots__ = ()
+
+    def draw(self):
+        """Draw both lines of the fixation cross."""
+        self.vertical.draw()
+        self.horizontal.draw()
+
+
+def _load_image(image_path):
     """
-    # Create a monitor object
-    current_monitor = monitors.Monitor(name='testMonitor')
+    Return the decoded image at the given path, reading it from disk only on the first call.
 
-    # Create and return a window for the experiment
-    return visual.Window(monitors.Monitor.getSizePix(current_monitor),
-                         monitor="testMonitor",
-                         allowGUI=True,
-                         fullscr=True,
-                         color=(255, 255, 255)
-                         )
+    Parameters:
+    image_path: Path of the image file.
+
+    Returns:
+    PIL.Image.Image: The decoded RGBA image.
+    """
+    from PIL import Image
+    if image_path not in _image_cache:
+        with Image.open(image_path) as image:
+            _image_cache[image_path] = image.convert('RGBA')
+    return _image_cache[image_path]
 
 
-def initialize_stimuli(window):
+def initialize_stimuli(window, rec_seconds=None):
     """
     Initialize and configure visual stimuli elements used in the experiment.
 
+    The stimuli are created once per window and recording duration; later calls return the same objects.
+
     Parameters:
     window: A PsychoPy visual.Window object where stimuli will be displayed.
+    rec_seconds: Duration in seconds for each recording. Defaults to `REC_SECONDS`, or to
+                 `VISUAL_FRAMES` frames at the measured frame rate if that is not set.
 
     Returns:
     Tuple containing:
-        fixation: Visual element representing the fixation cross.
+        fixation: Fixation cross (vertical and horizontal line) with a `draw()` method.
         audio_pic: Pictogram representing audio.
         rec_pic: Pictogram representing recording.
         prompt: Text element for prompts.
         fs: Sample rate for recordings.
         rec_seconds: Duration in seconds for each recording.
     """
+    if rec_seconds is None:
+        rec_seconds = REC_SECONDS
+    key = (id(window), rec_seconds)
+    if key in _stimuli_cache:
+        return _stimuli_cache[key]
+
+    from psychopy import visual
     # fixation cross
-    fixation = visual.ShapeStim(window,
-                                vertices=((0, -0.13), (0, 0.13), (0, 0), (-0.09, 0), (0.09, 0)),
-                                lineWidth=15,
-                                closeShape=False,
-                                lineColor="black",
-                                name='fixation')
+    fixation = Fixation(vertical=visual.Line(window,
+                                             start=(0, -0.13),
+                                             end=(0, 0.13),
+                                             lineWidth=15,
+                                             lineColor="black",
+                                             name='fixation_vertical'),
+                        horizontal=visual.Line(window,
+                                               start=(-0.09, 0),
+                                               end=(0.09, 0),
+                                               lineWidth=15,
+                                               lineColor="black",
+                                               name='fixation_horizontal'))
 
     # pictograms
     audio_pic = visual.ImageStim(window,
-                                 image=pics_path + 'audio.png',
+                                 image=_load_image(AUDIO_PNG),
                                  pos=(0, 0),
                                  name='audio_pic')
 
     rec_pic = visual.ImageStim(window,
-                               image=pics_path + 'rec.png',
+                               image=_load_image(REC_PNG),
                                pos=(0, 0),
                                name='rec_pic')
 
@@ -137,35 +267,61 @@ def initialize_stimuli(window):
                              color='black',
                              pos=(0, 0.6),
                              wrapWidth=2)
+    # Warm up the font atlas with representative text, so the first trial doesn't pay for it.
+    # Draw into the back buffer only and clear it again, so nothing is shown on screen.
+    prompt.text = 'A' * 40
+    prompt.draw()
+    window.clearBuffer()
+    # Leave the prompt empty again, as callers expect until they set their own text
+    prompt.text = ''
+
+    if rec_seconds is None:
+        # Calculate the recording duration in seconds from the monitor's refresh rate (measured once per window)
+        rec_seconds = VISUAL_FRAMES / _get_frame_rate(window)
 
-    # default parameters for the recordings
-    fs = 48000  # Sample rate
-    # Calculate the recording duration in seconds
-    visual_frames = 350
-    # automatically estimate monitor's refresh rate from window object
-    estimated_frame_rate = window.getActualFrameRate()
-    # If for some reason the function fails to get the actual frame rate, it will return None.
-    # In this case, you could default to a reasonable estimate, e.g., 60 Hz.
-    if estimated_frame_rate is None:
-        estimated_frame_rate = 60
+    _stimuli_cache[key] = fixation, audio_pic, rec_pic, prompt, FS, rec_seconds
+    return _stimuli_cache[key]
 
-    rec_seconds = visual_frames / estimated_frame_rate
 
-    return fixation, audio_pic, rec_pic, prompt, fs, rec_seconds
+def _save_last_participant(exp_data):
+    """Remember the subject ID of this session to pre-fill the dialog on the next run."""
+    with open(last_participant_file, 'w') as f:
+        json.dump({'subject': exp_data['subject']}, f)
 
 
-def get_participant_info():
+def get_participant_info(cli_args=None):
     """
-    Capture participant information before starting the experiment. Uses a GUI dialog.
+    Capture participant information before starting the experiment. Uses a GUI dialog,
+    unless the subject ID is given on the command line.
+
+    Parameters:
+    cli_args: Parsed command line arguments (argparse.Namespace). If it has a `subject`, the dialog is skipped.
 
     Returns:
     exp_data: A dictionary containing the experiment details and participant information. Returns None if the dialog is canceled.
     """
+    # Snapshot the session start once, so all later uses of cur_date refer to the same moment
+    now = datetime.datetime.now()
     exp_data = {
         'experiment': 'imitation_experiment',
         'subject': 'subjectID',
-        'cur_date': datetime.datetime.now().strftime("%Y-%m-%d_%Hh%M")  # Use strftime to format the date string
+        'cur_date': f"{now:%Y-%m-%d_%Hh%M}"
     }
+
+    # Skip the dialog if the subject ID was given on the command line
+    if cli_args is not None and getattr(cli_args, 'subject', None):
+        exp_data['subject'] = cli_args.subject
+        _save_last_participant(exp_data)
+        return exp_data
+
+    # Pre-populate the subject ID from the last run, if there is one
+    try:
+        with open(last_participant_file) as f:
+            exp_data['subject'] = json.load(f)['subject']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    from psychopy import gui, core
     # Dialogue box to get participant information
     info_dialog = gui.DlgFromDict(dictionary=exp_data,
                                   title='Imitation-Experiment',
@@ -173,46 +329,124 @@ def get_participant_info():
                                   )
 
     if info_dialog.OK:
+        _save_last_participant(exp_data)
         return exp_data
     else:
         core.quit()
 
 
-def append_result_to_csv(writer, result, file_exists, output_file):
+def _init_csv(output_filename, fieldnames, buffer_size=1 << 20):
     """
-    Append the result data of an experiment iteration to a CSV file.
+    Open a CSV file for appending and write the header if the file is new.
 
     Parameters:
-    writer: A csv.DictWriter object to write the data.
-    result: A dictionary containing the result data.
-    file_exists: Boolean indicating if the file already exists.
-    output_file: File object where the result should be written.
+    output_filename: Path of the CSV file.
+    fieldnames: Column names of the CSV file.
+    buffer_size: Size of the file buffer in bytes (default is 1 MiB).
+
+    Returns:
+    Tuple containing:
+        output_file: The open file object.
+        writer: A csv.writer object writing to the file.
     """
-    if not file_exists:
-        writer.writeheader()  # File doesn't exist yet, so write a header
-    writer.writerow(result)
-    output_file.flush()  # Flush Python's write buffer
-    os.fsync(output_file.fileno())  # Tell the OS to flush its buffers to disk
+    # Use a large buffer, so trial rows stay in user space until the file is flushed
+    output_file = open(output_filename, 'a', newline='', buffering=buffer_size)
+    writer = csv.writer(output_file)
+    # In append mode the position is at the end, so an empty file starts at 0
+    if output_file.tell() == 0:
+        writer.writerow(fieldnames)  # File is new, so write a header
+    return output_file, writer
 
 
-def show_message(win, message, wait_for_keypress=True, duration=1, text_height=0.1):
+class ResultWriter:
     """
-    Display a message on the experiment window. Optionally, wait for a keypress or show the message for a specified duration.
+    Append experiment results to a CSV file, buffering rows in memory and writing them in batches.
+
+    The file is opened once and kept open for the whole phase. Buffered rows are written every
+    `batch_size` results and on `flush_phase()`, and flushed to disk every `fsync_every` written rows,
+    on `checkpoint()` and on `close()`. Written rows may sit in the file buffer until the next sync,
+    so `close()` must be called at the end of a session to avoid losing data; using the writer
+    as a context manager does this automatically.
+
+    Parameters:
+    output_filename: Path of the CSV file the results are appended to.
+    fieldnames: Column names of the CSV file.
+    batch_size: Number of results buffered before they are written to the file (default is 16).
+                If None, rows are only written on `flush_phase()`, `checkpoint()` and `close()`.
+    fsync_every: Number of written rows after which the file is flushed to disk (default is 50).
+                 If None, rows are only flushed to disk on `checkpoint()` and `close()`.
+    buffer_size: Size of the file buffer in bytes (default is 1 MiB).
+    """
+
+    def __init__(self, output_filename, fieldnames, batch_size=16, fsync_every=50, buffer_size=1 << 20):
+        self._fh, self._writer = _init_csv(output_filename, fieldnames, buffer_size)
+        # Turns a result dictionary into a row tuple in column order
+        self._row = operator.itemgetter(*fieldnames)
+        self._buf = []
+        self.batch_size = batch_size
+        self.fsync_every = fsync_every
+        self._unsynced = 0
+
+    def append(self, result):
+        """
+        Buffer the result data of an experiment iteration, writing the buffer once it is full.
+
+        Parameters:
+        result: A dictionary containing the result data.
+        """
+        self._buf.append(self._row(result))
+        if self.batch_size is not None and len(self._buf) >= self.batch_size:
+            self.flush_phase()
+
+    def flush_phase(self):
+        """Write all buffered rows to the file in one call, e.g. at the end of a phase or block."""
+        self._write_buffer()
+        if self.fsync_every is not None and self._unsynced >= self.fsync_every:
+            self._sync()
+
+    def _write_buffer(self):
+        """Write all buffered rows to the file and clear the buffer."""
+        self._writer.writerows(self._buf)
+        self._unsynced += len(self._buf)
+        self._buf.clear()
+
+    def _sync(self):
+        """Flush the written rows to disk."""
+        self._fh.flush()  # Flush Python's write buffer
+        os.fsync(self._fh.fileno())  # Tell the OS to flush its buffers to disk
+        self._unsynced = 0
+
+    def checkpoint(self):
+        """Write the buffered rows and flush them to disk, e.g. at the end of a phase or session."""
+        self._write_buffer()
+        self._sync()
+
+    def close(self):
+        """Write the remaining buffered rows, flush them to disk and close the file."""
+        try:
+            self.checkpoint()
+        finally:
+            # Close the file even if writing or syncing fails, e.g. on a full disk
+            self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def get_text_stim(win, message, text_height=0.1):
+    """
+    Create a text stimulus for displaying messages on the experiment window.
 
     Parameters:
     win: A PsychoPy visual.Window object where the message will be displayed.
     message: The message text to be displayed.
-    wait_for_keypress: If True, waits for a keypress before proceeding. If False, waits for the specified duration.
-    duration: Duration (in seconds) for which the message should be displayed. Only used if `wait_for_keypress` is False.
     text_height: Height of the text (default is 0.1).
+
+    Returns:
+    text_stim: A PsychoPy visual.TextStim object with the message set as its text.
     """
-    # Create a text stimulus with the given message
-    text_stim = visual.TextStim(win, text=message, wrapWidth=2, height=text_height, color="black")
-    text_stim.draw()
-    # Flip the window to display the message
-    win.flip()
-    # Wait for a keypress or for a set duration
-    if wait_for_keypress:
-        event.waitKeys()
-    else:
-        core.wait(duration)
+    from psychopy import visual
+    return visual.TextStim(win, text=message, wrapWidth=2, height=text_height, color="black")
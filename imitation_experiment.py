@@ -8,26 +8,32 @@ At the end of each phase, a message is displayed on the screen.
 """
 
 # Import necessary PsychoPy libraries
+import argparse
 from imitation_path_and_randomization import check_and_create_config_paths, load_stimuli, load_and_randomize
-from imitation_configuration import get_participant_info, create_window, stim_path, output_path, pics_path, record_path, practice_stim_path, random_path
+from imitation_configuration import get_participant_info, create_window, close_window, stim_path, output_path, pics_path, record_path, practice_stim_path, random_path
 from imitation_functions import show_message, conduct_experiment_phase
 from psychopy import core
 from imitation_instructions import instructImitationTask, instructPracticeImitationEnd, imitationEnd
 
-# Get participant information from a GUI prompt
-participant_info = get_participant_info()
+# Parse command line arguments, e.g. to give the subject ID without the GUI prompt
+parser = argparse.ArgumentParser(description='Imitation experiment')
+parser.add_argument('--subject', help='subject ID; skips the participant dialog if given')
+args = parser.parse_args()
+
+# Get participant information from the command line or a GUI prompt
+participant_info = get_participant_info(args)
 # print(f'paths: {stim_path} {output_path} {pics_path} {record_path}')
 # Check and create necessary paths for stimuli and output, returning filenames for output CSVs
 check_and_create_config_paths(stim_path, practice_stim_path, pics_path, output_path, record_path, random_path, participant_info)
 
-# Create a window for displaying stimuli
+# Create a window for displaying stimuli (use create_window(lab=True) in the acoustic lab)
 window = create_window()
 
 # Load stimuli from the specified path for the practice phase
 practice_files = load_stimuli(practice_stim_path)
 
 # Load and/or randomize stimuli from the specified path for the test phase
-randomized_test_stimuli = load_and_randomize(stim_path, participant_info)
+randomized_test_stimuli = load_and_randomize(stim_path, participant_info, random_path)
 # Display instructions for the imitation task
 show_message(window, instructImitationTask)
 
@@ -50,5 +56,5 @@ window.flip()
 show_message(window, imitationEnd)
 
 # Close the window and quit the core PsychoPy routines
-window.close()
+close_window(window)
 core.quit()
@@ -19,27 +19,168 @@ Modules:
 
 
 # Import necessary libraries
-from psychopy import core, event, visual, prefs  # import some libraries from PsychoPy
-# Set the audio library preference
+from psychopy import core, event, prefs  # import some libraries from PsychoPy
+# Set the audio library preference (before psychopy.sound is imported for the first time)
 prefs.hardware['audioLib'] = ['ptb', 'sounddevice', 'pygame', 'pyo']
-# Now, import sound
-from psychopy import sound
+# psychopy.sound, sounddevice and scipy are imported in the functions that need them,
+# so their slow initialization doesn't delay the participant dialog and the window
+import atexit
+import concurrent.futures
+import numpy as np
+import threading
 import time
-import datetime
-import sounddevice as sd
-from scipy.io.wavfile import write
-from imitation_configuration import append_result_to_csv, initialize_stimuli
+import warnings
+from imitation_configuration import ResultWriter, initialize_stimuli, get_text_stim, output_path, record_path
 import os
-from imitation_path_and_randomization import get_manip, get_name_stim
-import csv
+from imitation_path_and_randomization import get_stimulus_data
 
 
-# Results list
-results = []
+# Message presenters per (window, text height), reused by show_message
+_message_presenters = {}
 
+# Background writer for the recordings, so saving a .wav file doesn't block the next trial
+_wav_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+# Recordings submitted to the background writer that may not be saved yet
+_pending_writes = []
 
-def present_trial(fixation, window, audio_pic, rec_seconds, fs, rec_pic, stimuli_full_path,
-                  participant_info, stimulus_file, phase_name, trial_counter):
+# Loaded stimuli per file path as (sound.Sound, duration) tuples, shared by all phases
+_sound_cache = {}
+
+# Columns of the results CSV file
+RESULT_FIELDS = ('experiment',
+                 'subjectID',
+                 'date',
+                 'trial',
+                 'phase',
+                 'stimulus',
+                 'recording',
+                 'manip',
+                 'name_stim',
+                 'start_time',
+                 'end_time',
+                 'duration',
+                 )
+
+
+def _drain_wav_writes():
+    """
+    Wait until all recordings submitted to the background writer are saved.
+
+    Raises:
+        Exception: The first error raised while saving a recording, so failed writes are not lost silently.
+    """
+    try:
+        for pending_write in _pending_writes:
+            pending_write.result()
+    finally:
+        _pending_writes.clear()
+
+
+# Save all pending recordings before the interpreter exits, e.g. after core.quit()
+atexit.register(_drain_wav_writes)
+
+
+def preload_sounds(stimuli_full_path, stimulus_files):
+    """
+    Load the sound of every stimulus before the trials start.
+
+    Sounds are cached per file path, so a stimulus used again later is not loaded a second time.
+
+    Parameters:
+        stimuli_full_path (str): Path to the directory containing stimuli files.
+        stimulus_files (list): Names of the stimulus files to load.
+
+    Returns:
+        dict: Dictionary mapping each stimulus file name to a tuple of its sound.Sound object and duration in seconds.
+    """
+    from psychopy import sound
+    preloaded = {}
+    for stimulus_file in stimulus_files:
+        path = os.path.join(stimuli_full_path, stimulus_file)
+        if path not in _sound_cache:
+            imitation_stimulus = sound.Sound(path, sampleRate=48000)
+            # Query the duration once here, instead of twice in every trial
+            _sound_cache[path] = (imitation_stimulus, imitation_stimulus.getDuration())
+        preloaded[stimulus_file] = _sound_cache[path]
+    return preloaded
+
+
+class Recorder:
+    """
+    Record into a preallocated buffer from an input stream that stays open for the whole phase.
+
+    Opening the audio device for every trial delays the start of the recording, so the stream
+    is opened once and only passes incoming samples to the buffer while a recording is running.
+    Use it as a context manager to start and close the stream.
+
+    Parameters:
+        buffer (numpy.ndarray): Preallocated buffer of shape (samples, channels) the recordings are captured into.
+        fs (int): Sampling rate for recording.
+    """
+
+    def __init__(self, buffer, fs):
+        import sounddevice as sd
+        self.buffer = buffer
+        self.fs = fs
+        self._filled = 0
+        self._recording = False
+        self._overflowed = False
+        self._done = threading.Event()
+        self._stream = sd.InputStream(samplerate=fs, channels=buffer.shape[1], dtype=buffer.dtype.name,
+                                      latency='low', callback=self._callback)
+
+    def _callback(self, indata, frames, time_info, status):
+        # Called by the audio thread for every block of incoming samples; ignore them between recordings
+        if not self._recording:
+            return
+        # Remember if input samples were dropped, so the recording can be flagged when it is complete
+        if status.input_overflow:
+            self._overflowed = True
+        n = min(frames, len(self.buffer) - self._filled)
+        self.buffer[self._filled:self._filled + n] = indata[:n]
+        self._filled += n
+        if self._filled == len(self.buffer):
+            # The buffer is full, the recording is complete
+            self._recording = False
+            self._done.set()
+
+    def start(self):
+        """
+        Start filling the buffer from the beginning with the incoming samples.
+        """
+        self._filled = 0
+        self._overflowed = False
+        self._done.clear()
+        self._recording = True
+
+    def wait(self, margin=2.0):
+        """
+        Wait until the buffer is filled and the recording is complete.
+
+        Parameters:
+            margin (float): Seconds to wait beyond the recording duration before giving up (default is 2.0).
+
+        Raises:
+            RuntimeError: If the input stream stops delivering samples before the buffer is filled.
+        """
+        if not self._done.wait(len(self.buffer) / self.fs + margin):
+            self._recording = False
+            raise RuntimeError(f"Recording timed out after {self._filled} of {len(self.buffer)} samples; "
+                               "the input stream stopped delivering audio (is the microphone still connected?)")
+        if self._overflowed:
+            warnings.warn("Input overflow during recording: some samples were dropped, the recording may contain gaps")
+
+    def __enter__(self):
+        self._stream.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._recording = False
+        self._stream.close()
+
+
+def present_trial(fixation, window, audio_pic, recorder, fs, rec_pic, imitation_stimulus, stim_duration,
+                  subj_path_rec, record_prefix, stimulus_name, trial_counter):
     """
     Present a trial to the participant.
 
@@ -47,68 +188,81 @@ def present_trial(fixation, window, audio_pic, rec_seconds, fs, rec_pic, stimuli
         fixation (object): Visual fixation point.
         window (object): PsychoPy visual window.
         audio_pic (object): Visual indicator that audio is playing.
-        rec_seconds (float): Duration for recording in seconds.
+        recorder (Recorder): Running recorder whose buffer the recording is captured into.
         fs (int): Sampling rate for recording.
         rec_pic (object): Visual indicator that recording is taking place.
-        stimuli_full_path (str): Path to the directory containing stimuli files.
-        participant_info (dict): Information about the participant.
-        stimulus_file (str): Name of the stimulus file to present.
-        phase_name (str): Name of the experiment phase ('practice' or other).
+        imitation_stimulus (object): Preloaded sound.Sound object of the stimulus.
+        stim_duration (float): Duration of the stimulus in seconds.
+        subj_path_rec (str): Existing directory where the participant's recordings are saved.
+        record_prefix (str): Start of the recording file names ('imitation_<subject>_<session date>_<phase>_').
+        stimulus_name (str): Name of the stimulus file without directory and extension.
         trial_counter (int): Counter indicating the current trial number.
 
     Returns:
         str: Name of the recorded response file.
     """
+    from scipy.io.wavfile import write
     # Display fixation point for 1 second
-    fixation.name = 'fixation'
     fixation.draw()
     window.flip()
     core.wait(1.0)
     window.flip()
 
-    # Check if stimulus_file is a string (path) or a Sound object
-    if isinstance(stimulus_file, str):
-        imitation_stimulus1 = sound.Sound(os.path.join(stimuli_full_path, stimulus_file), sampleRate=48000)
-        imitation_stimulus2 = sound.Sound(os.path.join(stimuli_full_path, stimulus_file), sampleRate=48000)
-    else:
-        imitation_stimulus1 = stimulus_file
-        imitation_stimulus2 = stimulus_file
-
-    # Loop twice to play stimulus and show audio_pic
-    for stimulus in [imitation_stimulus1, imitation_stimulus2]:
-        audio_pic.draw()
-        window.flip()
-        stimulus.play()
-
-        core.wait(stimulus.getDuration()+0.3)  # wait for the duration of the sound + 0.7 seconds
-        window.flip()  # clear the screen
-
-    # Start recording the participant's verbal response
-    response_record = sd.rec(int(rec_seconds * fs), samplerate=fs, channels=1)
-
-    # Present rec_pic for 350 frames
-    for frame in range(300):
-        rec_pic.draw()  # Draw pic
-        window.flip()  # Flip window to make rec_pic visible
-    # Stop the recording after the presentation is over
-    sd.stop()
-
-    # Path setup - results per participant
-    subj_path_rec = os.path.join('recordings', participant_info['subject'])
-    # Create the directory if it doesn't exist
-    if not os.path.exists(subj_path_rec):
-        os.makedirs(subj_path_rec)
+    # Show audio_pic once while the stimulus is played twice
+    audio_pic.draw()
+    # Start the first playback with the flip that shows audio_pic, instead of whenever the flip returns
+    window.callOnFlip(imitation_stimulus.play)
+    window.flip()
+    core.wait(stim_duration + 0.3)  # wait for the duration of the sound + 0.3 seconds
+    imitation_stimulus.stop()  # rewind the sound, so it can be played again
+    imitation_stimulus.play()
+    core.wait(stim_duration + 0.3)
+    imitation_stimulus.stop()
+    window.flip()  # clear the screen
+
+    # Start recording the participant's verbal response from the already open input stream
+    recorder.start()
+
+    # Present rec_pic for the duration of the recording; the image is static, so draw and flip it once
+    rec_pic.draw()
+    window.flip()
+    # Wait until the buffer is filled and the recording is complete
+    recorder.wait()
 
     # Save the participant's verbal response as a .wav file
-    filename = os.path.splitext(os.path.basename(stimulus_file))[0]
-    write(os.path.join(subj_path_rec, 'imitation' + '_' + participant_info['subject'] + '_' + phase_name + '_' +
-                       "{:02d}".format(trial_counter) + '_' + filename + '.wav'), fs, response_record)
-    response_record_name = 'imitation' + '_' + participant_info['subject'] + '_' + phase_name + '_' + \
-                           "{:02d}".format(trial_counter) + '_' + filename + '.wav'
+    response_record_name = f"{record_prefix}{trial_counter:02d}_{stimulus_name}.wav"
+    # Save in the background; the phase waits for all pending writes at its end
+    # Hand a copy to the writer, since the buffer is reused for the next trial
+    _pending_writes.append(_wav_executor.submit(write, os.path.join(subj_path_rec, response_record_name),
+                                                fs, recorder.buffer.copy()))
 
     return response_record_name
 
 
+def _iter_trials(phase_name, phase_stimuli):
+    """
+    Iterate over the trials of a phase in presentation order.
+
+    Parameters:
+        phase_name (str): Name of the experiment phase.
+        phase_stimuli (list or dict): List of stimuli for the practice phase, or dictionary of stimuli blocks otherwise.
+
+    Yields:
+        tuple: Stimulus file name and block number (starting from 0). After each block, including an empty one,
+               a tuple with None as the file name marks the end of the block.
+               Practice trials are not divided into blocks, so no block ends are yielded for them.
+    """
+    if phase_name == 'practice':
+        for stimulus_file in phase_stimuli:
+            yield stimulus_file, 0
+    else:
+        # Present each set of stimuli as one block
+        for block_number, stimuli_block in enumerate(phase_stimuli.values()):
+            for stimulus_file in stimuli_block:
+                yield stimulus_file, block_number
+            yield None, block_number
+
+
 def display_pause_screen(window, block_number, total_blocks):
     """
     Display a pause screen in between blocks.
@@ -138,130 +292,149 @@ def conduct_experiment_phase(window, phase_stimuli, phase_name, stimuli_full_pat
     """
     # path setup results per participant
     # Define the path in results for each subject
-    subj_path_results = os.path.join('results', participant_info['subject'])
+    subj_path_results = os.path.join(output_path, participant_info['subject'])
     # Create the directory if it doesn't exist
-    if not os.path.exists(subj_path_results):
-        os.makedirs(subj_path_results)
+    os.makedirs(subj_path_results, exist_ok=True)
+
+    # Path setup - recordings per participant, created once for the whole phase
+    subj_path_rec = os.path.join(record_path, participant_info['subject'])
+    os.makedirs(subj_path_rec, exist_ok=True)
+    # Start of the recording file names, the same for every trial of the phase; the session date keeps a
+    # repeated or reused subject ID from overwriting the recordings of an earlier session
+    record_prefix = f"imitation_{participant_info['subject']}_{participant_info['cur_date']}_{phase_name}_"
 
     fixation, audio_pic, rec_pic, prompt, fs, rec_seconds = initialize_stimuli(window)
+    # Recording buffer reused by every trial; int16 samples can be saved as .wav without conversion
+    rec_buffer = np.empty((int(rec_seconds * fs), 1), dtype='int16')
     # Initialize start time and format it into string
     start_time = time.time()
-    start_time_str = datetime.datetime.fromtimestamp(start_time).strftime('%H:%M:%S')
+    start_local_time = time.localtime(start_time)
+    start_time_str = time.strftime('%H:%M:%S', start_local_time)
+    # Measure the duration on the monotonic clock, which is not affected by changes of the system time
+    start_mono = time.monotonic()
     trial_counter = 1
+    # Trial data of this phase only
+    results = []
 
-    # generate the base_filename based on task_name and phase
-    output_filename = f"{subj_path_results}/{phase_name}_{participant_info['experiment']}_{participant_info['subject']}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-
-    file_exists = os.path.isfile(output_filename)
+    # generate the base_filename based on task_name and phase, stamped with the start time of the phase
+    output_filename = f"{subj_path_results}/{phase_name}_{participant_info['experiment']}_{participant_info['subject']}_{time.strftime('%Y%m%d_%H%M%S', start_local_time)}.csv"
 
     # Get the total number of blocks
     total_blocks = len(phase_stimuli)
 
-    # Open file once, before the loop
-    with open(output_filename, 'a', newline='') as output_file:
-        writer = csv.DictWriter(output_file, fieldnames=['experiment',
-                                                         'subjectID',
-                                                         'date',
-                                                         'trial',
-                                                         'phase',
-                                                         'stimulus',
-                                                         'recording',
-                                                         'manip',
-                                                         'name_stim',
-                                                         'start_time',
-                                                         'end_time',
-                                                         'duration',
-                                                         ])
-
-        if phase_name == 'practice':
-            for stimulus_file in phase_stimuli:
+    # Load all sounds of this phase before the trials, so no file is decoded during a trial
+    stimulus_files = [stimulus_file for stimulus_file, _ in _iter_trials(phase_name, phase_stimuli)
+                      if stimulus_file is not None]
+    preloaded_sounds = preload_sounds(stimuli_full_path, stimulus_files)
+    # Derive the stimulus data and the file name without directory and extension (for the recording names)
+    # once, instead of in every trial
+    stimulus_meta = {}
+    for stimulus_file in stimulus_files:
+        stimulus_data = get_stimulus_data(stimulus_file)
+        stimulus_meta[stimulus_file] = (stimulus_data.manip, stimulus_data.name_stim,
+                                        os.path.splitext(os.path.basename(stimulus_file))[0])
+
+    # Trial data that is the same for every trial of the phase
+    base_row = {
+        'experiment': participant_info['experiment'],
+        'subjectID': participant_info['subject'],
+        'date': participant_info['cur_date'],
+        'phase': phase_name,
+        'start_time': start_time_str,
+    }
+
+    # Open file once, before the loop; it is flushed to disk and closed when the phase ends, even if a trial fails
+    # Rows are kept in memory and written every 16 trials; they are flushed to disk per block and at the end of the phase
+    # The input stream is opened once for the phase and closed at its end
+    with ResultWriter(output_filename, fieldnames=RESULT_FIELDS, batch_size=16, fsync_every=None) as writer, \
+            Recorder(rec_buffer, fs) as recorder:
+        try:
+            for stimulus_file, block_number in _iter_trials(phase_name, phase_stimuli):
+                if stimulus_file is None:
+                    # End of a block: write its rows and flush them to disk while the participant can take a break
+                    writer.checkpoint()
+
+                    # After each block, show the prompt unless it's the last block
+                    if block_number + 1 != total_blocks:
+                        display_pause_screen(window, block_number, total_blocks)
+                    continue
+
+                manip, name_stim, stimulus_name = stimulus_meta[stimulus_file]
                 response_record_name = present_trial(
-                    fixation, window, audio_pic, rec_seconds, fs, rec_pic, stimuli_full_path,
-                    participant_info, stimulus_file, phase_name, trial_counter)
+                    fixation, window, audio_pic, recorder, fs, rec_pic, *preloaded_sounds[stimulus_file],
+                    subj_path_rec, record_prefix, stimulus_name, trial_counter)
 
                 # Record end time and duration
                 end_time = time.time()
-                end_time_str = datetime.datetime.fromtimestamp(end_time).strftime('%H:%M:%S')
-                duration = end_time - start_time
-                hours, remainder = divmod(duration, 3600)
-                minutes, seconds = divmod(remainder, 60)
-                duration_str = '{:02d}:{:02d}:{:02d}'.format(int(hours), int(minutes), int(seconds))
+                end_time_str = time.strftime('%H:%M:%S', time.localtime(end_time))
+                elapsed = int(time.monotonic() - start_mono)
+                duration_str = f"{elapsed // 3600:02d}:{elapsed % 3600 // 60:02d}:{elapsed % 60:02d}"
 
                 # Store trial data
                 trial_data = {
-                    'experiment': participant_info['experiment'],
-                    'subjectID': participant_info['subject'],
-                    'date': participant_info['cur_date'],
+                    **base_row,
                     'trial': "{:02d}".format(trial_counter),
-                    'phase': phase_name,
                     'stimulus': stimulus_file,
                     'recording': response_record_name,
-                    'manip': get_manip(stimulus_file),
-                    'name_stim': get_name_stim(stimulus_file),
-                    'start_time': start_time_str,
+                    'manip': manip,
+                    'name_stim': name_stim,
                     'end_time': end_time_str,
                     'duration': duration_str
                 }
                 results.append(trial_data)
 
-                # Write data to csv file
-                append_result_to_csv(writer, trial_data, file_exists, output_file)
-
-                if not file_exists:
-                    file_exists = True  # After first write, file definitely exists
+                # Buffer data for the csv file
+                writer.append(trial_data)
 
                 # Increment trial counter
                 trial_counter += 1
-        else:
-            # Present each set of stimuli as one block
-            # Enumerate provides the block number (starting from 0, so we add 1)
-            for block_number, (name_coord, stimuli_block) in enumerate(phase_stimuli.items()):
-                for stimulus_file in stimuli_block:
-                    response_record_name = present_trial(
-                        fixation, window, audio_pic, rec_seconds, fs, rec_pic, stimuli_full_path,
-                        participant_info, stimulus_file, phase_name, trial_counter)
-
-                    # Record end time and duration
-                    end_time = time.time()
-                    end_time_str = datetime.datetime.fromtimestamp(end_time).strftime('%H:%M:%S')
-                    duration = end_time - start_time
-                    hours, remainder = divmod(duration, 3600)
-                    minutes, seconds = divmod(remainder, 60)
-                    duration_str = '{:02d}:{:02d}:{:02d}'.format(int(hours), int(minutes), int(seconds))
-
-                    # Store trial data
-                    trial_data = {
-                        'experiment': participant_info['experiment'],
-                        'subjectID': participant_info['subject'],
-                        'date': participant_info['cur_date'],
-                        'trial': "{:02d}".format(trial_counter),
-                        'phase': phase_name,
-                        'stimulus': stimulus_file,
-                        'recording': response_record_name,
-                        'manip': get_manip(stimulus_file),
-                        'name_stim': get_name_stim(stimulus_file),
-                        'start_time': start_time_str,
-                        'end_time': end_time_str,
-                        'duration': duration_str
-                    }
-                    results.append(trial_data)
-
-                    # Write data to csv file
-                    append_result_to_csv(writer, trial_data, file_exists, output_file)
-
-                    if not file_exists:
-                        file_exists = True  # After first write, file definitely exists
-
-                    # Increment trial counter
-                    trial_counter += 1
-
-                # After each block, show the prompt unless it's the last block or the phase is 'practice'
-                if block_number + 1 != total_blocks:
-                    display_pause_screen(window, block_number, total_blocks)
+        finally:
+            # Make sure all recordings of the phase are saved before moving on
+            _drain_wav_writes()
 
     return results
 
 
+class MessagePresenter:
+    """
+    Display text messages on one window, reusing the same text stimulus for every message.
+
+    The window flip, key waiting and timed waiting functions are bound once on construction,
+    so showing a message does not look them up again.
+
+    Parameters:
+        window (object): PsychoPy visual window.
+        text_height (float): Height of the text (default is 0.1).
+    """
+
+    def __init__(self, window, text_height=0.1):
+        self.window = window
+        # The presenter owns its text stimulus; show_message caches one presenter per window and text height
+        self._stim = get_text_stim(window, '', text_height)
+        self._flip = window.flip
+        self._wait_keys = event.waitKeys
+        self._wait = core.wait
+
+    def show(self, message, wait_for_keypress=True, duration=1):
+        """
+        Display a text message on the screen.
+
+        Parameters:
+            message (str): Message to be displayed.
+            wait_for_keypress (bool): If True, waits for key press; otherwise waits for a duration.
+            duration (float): Time in seconds to wait if not waiting for a keypress.
+        """
+        # Only set the text if it changed, since setting it lays out the text again
+        if self._stim.text != message:
+            self._stim.text = message
+        self._stim.draw()
+        self._flip()
+        if wait_for_keypress:
+            self._wait_keys(keyList=['return'])
+        else:
+            self._wait(duration)
+
+
 def show_message(window, message, wait_for_keypress=True, duration=1, text_height=0.1):
     """
     Display a text message on the screen.
@@ -273,10 +446,10 @@ def show_message(window, message, wait_for_keypress=True, duration=1, text_heigh
         duration (float): Time in seconds to wait if not waiting for a keypress.
         text_height (float): Height of the text (default is 0.1).
     """
-    text_stim = visual.TextStim(window, text=message, wrapWidth=2, height=text_height, color="black")
-    text_stim.draw()
-    window.flip()
-    if wait_for_keypress:
-        event.waitKeys(keyList=['return'])
-    else:
-        core.wait(duration)
+    key = (id(window), text_height)
+    presenter = _message_presenters.get(key)
+    # Create a presenter on first use, or if the id now belongs to a new window
+    if presenter is None or presenter.window is not window:
+        presenter = MessagePresenter(window, text_height)
+        _message_presenters[key] = presenter
+    presenter.show(message, wait_for_keypress, duration)
@@ -10,13 +10,16 @@ The primary components of the module focus on:
     - The `randomize_stimuli_based_on_name_coordination` function provides a systematic way to segregate
       stimuli based on predefined coordination groups and then randomize their order.
 
-    - The `randomize_stimuli` function extracts relevant data from each stimulus filename and randomizes the stimuli.
+    - The `randomize_stimuli` function randomizes the stimuli and groups them by name coordination.
+
+    - The `seed_randomization` function seeds the module's random number generator for reproducible orders.
 
 2. **File and Directory Handling**:
     - `check_and_create_config_paths` ensures the necessary directories exist for stimuli, practice stimuli,
       output results, pictures, recordings, and randomized stimuli. If they don't, directories are created as needed.
 
-    - The `load_stimuli` function fetches all '.wav' stimuli files from a specified directory.
+    - The `load_stimuli` function fetches all '.wav' stimuli files from a specified directory;
+      `iter_stimuli` yields them lazily instead.
 
     - The `save_randomized_stimuli` function saves randomized stimuli data for each participant in a structured CSV format.
 
@@ -31,7 +34,7 @@ The primary components of the module focus on:
     - The `load_and_randomize` function is a comprehensive utility that wraps the process of loading, randomizing,
       and saving stimuli.
 
-Module-wide, the `name_coordinations` list defines the name coordination groups used for stimuli randomization.
+Module-wide, the `name_coordinations` tuple defines the name coordination groups used for stimuli randomization.
 
 The module aims to provide a robust set of tools to manage auditory stimuli, especially for experimental settings where
 the order and categorization of stimuli can influence results. By following the predefined patterns and using the
@@ -44,48 +47,111 @@ utilities in this module, researchers can ensure systematic, reproducible random
 import os
 import random
 import csv
+import functools
+import itertools
+import re
+import stat
+from collections import namedtuple
 
 
 # Define name coordination groups for stimuli randomization
-name_coordinations = [
+name_coordinations = (
     'gabi__leni__',
     'leni__mimmi_',
     'lilli_gabi__',
     'moni__lilli_',
     'nelli_moni__'
-]
+)
+
+# All name coordinations have the same length, so the group of a stimulus is found from this many leading characters
+_coordination_length = len(name_coordinations[0])
+
+# Data extracted from a stimulus filename
+StimulusData = namedtuple('StimulusData', ['filename', 'manip', 'name_stim'])
+
+# Random number generator of this module, independent of the global one of the random module
+_rng = random.Random()
+
+# Characters of the session date that are replaced to make it usable in file names
+_date_to_filename = str.maketrans({':': '-', ' ': '_'})
+
+# Last non-empty '_'-separated segment of a stimulus filename, which holds the manipulation type
+_manip_pattern = re.compile(r'([^_]+)_*$')
+
 
-def randomize_stimuli_based_on_name_coordination(stimuli_data_list):
+def seed_randomization(seed):
     """
-    Randomize the given stimuli data based on predefined name coordinations.
+    Seed the stimuli randomization, e.g. to reproduce the stimulus order of a participant.
 
     Parameters:
-    - stimuli_data_list (list): List of dictionaries containing stimulus data.
+    - seed (int): Seed for the random number generator of this module.
+    """
+    _rng.seed(seed)
 
-    Returns:
-    - list: List of randomized stimulus data dictionaries.
 
-    The function segregates stimuli data into predefined coordination groups,
-    randomizes the order of these groups, and further randomizes stimuli within each group.
+def _group_by_name_coordination(stimuli_files):
+    """
+    Split stimuli into their name coordination groups and randomize the groups and their order.
+
+    Parameters:
+    - stimuli_files (list): List of stimuli filenames.
+
+    Returns:
+    - dict: Dictionary of name coordinations and their lists of randomized filenames, in randomized order.
     """
     # Split stimuli into groups based on name coordination
     coordination_groups = {coordination: [] for coordination in name_coordinations}
-    for stimulus_data in stimuli_data_list:
-        stimulus = stimulus_data['filename']
-        for coordination in name_coordinations:
-            if stimulus.startswith(coordination):
-                coordination_groups[coordination].append(stimulus_data)
-                break
-    # Randomize the order of name coordinations
-    random.shuffle(name_coordinations)
-    # Randomize stimuli within each coordination group
-    for coordination in name_coordinations:
-        random.shuffle(coordination_groups[coordination])
-    # Combine the stimuli data back into a single list
-    randomized_stimuli_data = []
-    for coordination in name_coordinations:
-        randomized_stimuli_data.extend(coordination_groups[coordination])
-    return randomized_stimuli_data
+    for stimulus in stimuli_files:
+        # One lookup of the filename prefix instead of comparing it to every coordination
+        group = coordination_groups.get(stimulus[:_coordination_length])
+        if group is not None:
+            group.append(stimulus)
+    # Randomize the order of name coordinations in a new list, leaving the module-level tuple unchanged
+    coordination_order = _rng.sample(name_coordinations, len(name_coordinations))
+    # Randomize stimuli within each coordination group, keeping the groups in the randomized order
+    randomized_groups = {}
+    for coordination in coordination_order:
+        _rng.shuffle(coordination_groups[coordination])
+        randomized_groups[coordination] = coordination_groups[coordination]
+    return randomized_groups
+
+
+def randomize_stimuli_based_on_name_coordination(stimuli_files):
+    """
+    Randomize the given stimuli based on predefined name coordinations.
+
+    Parameters:
+    - stimuli_files (list): List of stimuli filenames.
+
+    Returns:
+    - list: List of randomized stimuli filenames.
+
+    The function segregates stimuli into predefined coordination groups,
+    randomizes the order of these groups, and further randomizes stimuli within each group.
+    """
+    # Combine the stimuli back into a single list
+    return list(itertools.chain.from_iterable(_group_by_name_coordination(stimuli_files).values()))
+
+
+def _require_dir(path, message):
+    """
+    Make sure a required input directory exists.
+
+    Parameters:
+    - path (str): Path of the required directory.
+    - message (str): Error message if the directory does not exist.
+
+    Raises:
+    - Exception: If the path does not exist or is not a directory.
+    """
+    # One stat call tells both whether the path exists and whether it is a directory
+    try:
+        mode = os.stat(path).st_mode
+    except OSError as error:
+        # Missing, not reachable (a path component is a file) or not accessible
+        raise Exception(message) from error
+    if not stat.S_ISDIR(mode):
+        raise Exception(f"{path} is not a folder. {message}")
 
 
 def check_and_create_config_paths(stim_path, practice_stim_path, pics_path,
@@ -108,41 +174,58 @@ def check_and_create_config_paths(stim_path, practice_stim_path, pics_path,
 
     The function ensures all required directories exist before the experiment starts.
     """
-    # Check if the input directory for test stimuli exists
-    if not os.path.exists(stim_path):
-        # Raise exception if not
-        raise Exception("No input folder detected. Please make sure that "
-                        "'test_stimuli_path' is correctly set in the configurations")
-
-    # Check if the input directory for test stimuli exists
-    if not os.path.exists(practice_stim_path):
-        # Raise exception if not
-        raise Exception("No input folder detected. Please make sure that "
-                        "'practice_stimuli_path' is correctly set in the configurations")
-
-    # Check if the pics directory exists
-    if not os.path.exists(pics_path):
-        # Raise exception if not
-        raise Exception("No pics folder detected. Please make sure that "
-                        "'pics_path' is correctly set in the configurations")
-
-    # Check if the output directory exists, if not, create it
-    if not os.path.exists(output_path):
-        os.mkdir(output_path)
-
-    # Check if the path to recorded files exists, if not, create it
-    if not os.path.exists(record_path):
-        os.mkdir(record_path)
-
-    # Check if the path to randomization files exists, if not, create it
-    if not os.path.exists(random_path):
-        os.mkdir(random_path)
+    # Check if the input directories for test and practice stimuli and the pics directory exist
+    _require_dir(stim_path, "No input folder detected. Please make sure that "
+                            "'test_stimuli_path' is correctly set in the configurations")
+    _require_dir(practice_stim_path, "No input folder detected. Please make sure that "
+                                     "'practice_stimuli_path' is correctly set in the configurations")
+    _require_dir(pics_path, "No pics folder detected. Please make sure that "
+                            "'pics_path' is correctly set in the configurations")
+
+    # Create the output, recordings and randomization directories; existing ones are left as they are
+    os.makedirs(output_path, exist_ok=True)
+    os.makedirs(record_path, exist_ok=True)
+    os.makedirs(random_path, exist_ok=True)
 
     # Path setup - results per participant
     subj_path_results = os.path.join(output_path, participant_info['subject'])
     # Create the directory if it doesn't exist
-    if not os.path.exists(subj_path_results):
-        os.makedirs(subj_path_results)
+    os.makedirs(subj_path_results, exist_ok=True)
+
+
+def iter_stimuli(stim_path):
+    """
+    Iterate lazily over the '.wav' stimuli files in a given directory.
+
+    Parameters:
+    - stim_path (str): Directory path where stimuli files are located.
+
+    Yields:
+    - str: Filename of a stimulus.
+
+    Unlike `load_stimuli`, the directory is scanned on every call and no list is built,
+    which suits callers that only go through the files once, e.g. to count them.
+    """
+    # Scan the directory once; the entries already know their file type, so no extra stat call is needed
+    with os.scandir(stim_path) as entries:
+        for entry in entries:
+            if entry.name.endswith('.wav') and entry.is_file():
+                yield entry.name
+
+
+@functools.lru_cache(maxsize=8)
+def _scan_stimuli(stim_path, mtime_ns):
+    """
+    Scan a directory for '.wav' stimuli files, caching the result per directory and modification time.
+
+    Parameters:
+    - stim_path (str): Directory path where stimuli files are located.
+    - mtime_ns (int): Modification time of the directory; a new time means files were added, removed or renamed.
+
+    Returns:
+    - tuple: Filenames of stimuli.
+    """
+    return tuple(iter_stimuli(stim_path))
 
 
 def load_stimuli(stim_path):
@@ -155,14 +238,14 @@ def load_stimuli(stim_path):
     Returns:
     - list: List of filenames of stimuli.
 
+    The directory is only scanned again if it changed since the last call.
     """
-    # Use a list comprehension to get all '.wav' files in the directory
-    return [f for f in os.listdir(stim_path) if f.endswith('.wav')]
+    return list(_scan_stimuli(stim_path, os.stat(stim_path).st_mtime_ns))
 
 
 def randomize_stimuli(stimuli_files):
     """
-    Extract stimulus data from provided files and randomize them.
+    Randomize the provided stimuli files.
 
     Parameters:
     - stimuli_files (list): List of stimuli filenames.
@@ -170,60 +253,50 @@ def randomize_stimuli(stimuli_files):
     Returns:
     - dict: Dictionary where keys are name coordinations and values are lists of randomized filenames.
 
-    This function first extracts relevant data from each filename, then randomizes stimuli
-    based on name coordinations and segregates them for further use.
+    This function randomizes stimuli based on name coordinations and segregates them for further use.
+    The grouping only needs the filenames, so no stimulus data is extracted here.
     """
-    # Extract stimulus data for each file
-    stimulus_data = [get_stimulus_data(file) for file in stimuli_files]
-
-    # Randomize order of stimuli with constraints
-    randomized_stimuli_data = randomize_stimuli_based_on_name_coordination(stimulus_data)
-
-    # Now, extract the filenames from the data
-    randomized_stimuli = [data['filename'] for data in randomized_stimuli_data]
-
-    # Segregate stimuli based on their name_coord prefix and save as separate lists
-    segregated_stimuli = {}
-    for name_coord in name_coordinations:
-        segregated_stimuli[name_coord] = [stim for stim in randomized_stimuli if stim.startswith(name_coord)]
-
-    return segregated_stimuli
+    # Randomize the stimuli within their name coordination groups; the groups are kept as separate lists
+    return _group_by_name_coordination(stimuli_files)
 
 
-def save_randomized_stimuli(randomized_stimuli, participant_info):
+def save_randomized_stimuli(randomized_stimuli, participant_info, random_path):
     """
     Save the randomized stimuli to a CSV file.
 
     Parameters:
-    - randomized_stimuli (dict): Dictionary containing randomized stimuli filenames.
+    - randomized_stimuli (dict): Dictionary of name coordinations and their lists of randomized stimuli filenames.
     - participant_info (dict): Dictionary containing participant's details.
+    - random_path (str): Directory where randomized stimuli are stored.
 
-    This function writes the randomized stimuli to a CSV file in a directory named
+    This function writes the randomized stimuli to a CSV file in a directory in `random_path` named
     after the participant's subject code. The filename contains the subject code and current date.
     """
+    subject = participant_info['subject']
     # Create a directory for this participant if it doesn't exist
-    directory = os.path.join('randomization', participant_info['subject'])
+    directory = os.path.join(random_path, subject)
     os.makedirs(directory, exist_ok=True)
 
     # Define file path
-    filename = f"{participant_info['subject']}_{participant_info['cur_date'].replace(':', '-').replace(' ', '_')}_randomized_imitation_stimuli.csv"
+    filename = f"{subject}_{participant_info['cur_date'].translate(_date_to_filename)}_randomized_imitation_stimuli.csv"
     filepath = os.path.join(directory, filename)
 
     # Write csv file
-    with open(filepath, 'w', newline='') as csvfile:
+    with open(filepath, 'w', newline='', buffering=1 << 20) as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(["filename"])  # header
-        for row in randomized_stimuli:
-            writer.writerow([row])
+        # Write the filenames of all blocks in order, in one call
+        writer.writerows((row,) for row in itertools.chain.from_iterable(randomized_stimuli.values()))
 
 
-def load_and_randomize(stim_path, participant_info):
+def load_and_randomize(stim_path, participant_info, random_path):
     """
     Load, randomize, and save stimuli.
 
     Parameters:
     - stim_path (str): Directory path where stimuli files are located.
     - participant_info (dict): Dictionary containing participant's details.
+    - random_path (str): Directory where randomized stimuli are stored.
 
     Returns:
     - dict: Dictionary containing randomized stimuli filenames.
@@ -235,7 +308,7 @@ def load_and_randomize(stim_path, participant_info):
     # Randomize stimuli
     randomized_stimuli = randomize_stimuli(stimuli_files)
     # Save randomized stimuli
-    save_randomized_stimuli(randomized_stimuli, participant_info)
+    save_randomized_stimuli(randomized_stimuli, participant_info, random_path)
 
     return randomized_stimuli
 
@@ -252,8 +325,8 @@ def get_manip(filename):
 
     The manipulation type is determined from the last segment of the filename before the ".wav" extension.
     """
-    split_name = [part for part in filename.split('_') if part]
-    return split_name[-1].replace('.wav', '')  # Last segment without the .wav extension
+    # Match the last segment directly instead of splitting the whole filename
+    return _manip_pattern.search(filename).group(1).replace('.wav', '')  # Last segment without the .wav extension
 
 
 def get_name_stim(filename):
@@ -268,10 +341,12 @@ def get_name_stim(filename):
 
     This function is used to retrieve the unique identifier of the stimulus from the filename.
     """
-    extracted_names = filename.split('_bra_')[0] + '_'
+    # Everything before the first '_bra_'; partition stops at the first match instead of splitting the whole name
+    extracted_names = filename.partition('_bra_')[0] + '_'
     return extracted_names
 
 
+@functools.lru_cache(maxsize=1024)
 def get_stimulus_data(filename):
     """
     Extract relevant stimulus data from a given filename.
@@ -280,13 +355,10 @@ def get_stimulus_data(filename):
     - filename (str): Stimulus filename.
 
     Returns:
-    - dict: Dictionary containing 'filename', 'manip', and 'name_stim' extracted from the filename.
+    - StimulusData: Named tuple containing 'filename', 'manip', and 'name_stim' extracted from the filename.
 
     This function provides a standardized way to extract relevant details from stimulus filenames.
+    The data is cached per filename, so each filename is only parsed once per session.
     """
-    return {
-        'filename': filename,
-        'manip': get_manip(filename),
-        'name_stim': get_name_stim(filename),
-    }
+    return StimulusData(filename, get_manip(filename), get_name_stim(filename))
 